@@ -16,13 +16,20 @@ Env vars:
   MOCK_IMAGE        - Docker image to run (default: "lovegood-comfyui:latest")
   MODELS_PATH       - Host path to mount at /workspace inside the container
   SIDECAR_PORT      - Port the sidecar listens on inside the container (default: 8189)
+  MOCK_POOL_SIZE    - Number of pre-created containers kept warm so POST /pods
+                      can skip container creation (default: 0, disabled)
+  MOCK_API_WORKERS  - Uvicorn worker processes (default: 1; >1 makes the pod
+                      registry per-worker and must be launched from the repo
+                      root via `python -m orchestrators.pod_api_mock`)
 """
 import asyncio
 import json
 import os
+import queue
 import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
 import uvicorn
@@ -40,13 +47,36 @@ MOCK_IMAGE = os.environ.get("MOCK_IMAGE", "lovegood-comfyui:latest")
 MODELS_PATH = os.environ.get("MODELS_PATH", "")
 SIDECAR_PORT = int(os.environ.get("SIDECAR_PORT", "8189"))
 MOCK_API_PORT = int(os.environ.get("MOCK_API_PORT", "9000"))
+MOCK_POOL_SIZE = int(os.environ.get("MOCK_POOL_SIZE", "0"))
+MOCK_BOOT_CONCURRENCY = int(os.environ.get("MOCK_BOOT_CONCURRENCY", "4"))
+MOCK_API_WORKERS = int(os.environ.get("MOCK_API_WORKERS", "1"))
+
+# How long a pod's desiredStatus read from Docker stays fresh. Status
+# pollers hit GET /pods/{id} in a tight loop; without this every poll is
+# a round trip to the Docker socket.
+STATUS_CACHE_TTL_S = 0.5
 
 docker_client = docker.from_env()
 
-# In-memory pod registry: pod_id -> pod record
+# In-memory pod registry: pod_id -> pod record. Copy-on-write: writers
+# build a fresh dict under _lock and swap the reference; readers just grab
+# the current reference (atomic under the GIL) and never take the lock.
 _pods: Dict[str, dict] = {}
 _lock = threading.Lock()
 
+# GPU availability, probed once per process (None = not probed yet)
+_GPU_AVAILABLE: Optional[bool] = None
+
+# Warm container pool: (pod_id, container_id) tuples, pre-created but not
+# started. Env is baked into a container at create time, so each warm
+# container carries a pre-assigned pod id that create_pod adopts on pop.
+_pool: "queue.Queue" = queue.Queue()
+
+# Shared executor for container boots and pool refills. Bounds how many
+# concurrent run/create calls hit the Docker daemon at once instead of
+# spawning an unbounded thread per request.
+_BOOT_POOL = ThreadPoolExecutor(max_workers=MOCK_BOOT_CONCURRENCY, thread_name_prefix="pod-boot")
+
 app = FastAPI(title="RunPod Pod API Mock")
 
 # ---------------------------------------------------------------------------
@@ -61,88 +91,179 @@ def _check_auth(authorization: Optional[str]):
 # Helpers
 # ---------------------------------------------------------------------------
 
+# Docker container status -> RunPod desiredStatus
+_STATUS_MAP = {"running": "RUNNING", "exited": "EXITED", "paused": "PAUSED", "created": "STARTING"}
+
+# Pod records are stored in response shape, so shaping a response is just a
+# key filter. Keys outside this set (status cache, Container handle) are
+# internal bookkeeping; _containerId/_sidecarUrl stay exposed for pod_manager.
+_RESPONSE_KEYS = frozenset({
+    "id", "name", "desiredStatus", "image", "env", "ports", "portMappings",
+    "containerDiskInGb", "volumeMountPath", "lastStartedAt", "lastStatusChange",
+    "machine", "gpu", "costPerHr", "adjustedCostPerHr",
+    "_containerId", "_sidecarUrl",
+})
+
+# Stub machine/gpu fields so callers don't have to null-check. Shared,
+# read-only.
+_MACHINE_STUB = {"gpuTypeId": "LOCAL_DOCKER", "location": "local"}
+_GPU_STUB = {"id": "LOCAL", "count": 1, "displayName": "Local Docker"}
+
+
 def _make_pod_response(pod: dict) -> dict:
-    """Shape a pod record into the RunPod API response format."""
-    return {
-        "id": pod["id"],
-        "name": pod["name"],
-        "desiredStatus": pod["desiredStatus"],
-        "image": pod["image"],
-        "env": pod.get("env", {}),
-        "ports": pod.get("ports", []),
-        "portMappings": pod.get("portMappings", {}),
-        "containerDiskInGb": pod.get("containerDiskInGb", 50),
-        "volumeMountPath": "/workspace",
-        "lastStartedAt": pod.get("lastStartedAt"),
-        "lastStatusChange": pod.get("lastStatusChange"),
-        # Stub machine/gpu fields so callers don't have to null-check
-        "machine": {"gpuTypeId": "LOCAL_DOCKER", "location": "local"},
-        "gpu": {"id": "LOCAL", "count": 1, "displayName": "Local Docker"},
-        "costPerHr": "0.00",
-        "adjustedCostPerHr": 0.0,
-        # Internal: container id for our own use
-        "_containerId": pod.get("containerId"),
-        "_sidecarUrl": pod.get("sidecarUrl"),
-    }
+    """Project a pod record down to the RunPod API response shape."""
+    return {k: v for k, v in pod.items() if k in _RESPONSE_KEYS}
 
 
-def _start_container(pod_id: str, image: str, env: dict, name: str) -> dict:
+def _detect_gpu() -> bool:
     """
-    Spin up a Docker container for this pod.
-    Returns updated fields to merge into the pod record.
+    Check once whether Docker can hand GPUs to containers.
+    The result is memoized for the lifetime of the process so we don't
+    pay a daemon round trip on every pod creation.
     """
+    global _GPU_AVAILABLE
+    with _lock:
+        if _GPU_AVAILABLE is not None:
+            return _GPU_AVAILABLE
+        try:
+            runtimes = docker_client.info().get("Runtimes", {})
+            _GPU_AVAILABLE = "nvidia" in runtimes
+        except Exception:
+            _GPU_AVAILABLE = False
+        print(f"[mock-api] GPU {'available' if _GPU_AVAILABLE else 'not available'} (probed once)")
+        return _GPU_AVAILABLE
+
+
+def _container_kwargs(pod_id: str, image: str, env: dict) -> dict:
+    """Build the docker-py kwargs for a pod's container."""
     container_env = {**env, "POD_ID": pod_id, "RUNPOD_POD_ID": pod_id}
 
     volumes = {}
     if MODELS_PATH and os.path.exists(MODELS_PATH):
         volumes[MODELS_PATH] = {"bind": "/workspace", "mode": "rw"}
 
-    # Detect GPU
-    device_requests = None
-    try:
-        docker_client.containers.run(
-            "nvidia/cuda:11.8.0-base-ubuntu22.04", "nvidia-smi",
-            remove=True,
-            device_requests=[docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])]
-        )
-        device_requests = [docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])]
-        print(f"[mock-api] GPU available for pod {pod_id}")
-    except Exception:
-        print(f"[mock-api] No GPU, running CPU-only for pod {pod_id}")
-
-    run_kwargs = {
+    kwargs = {
         "image": image,
         "environment": container_env,
         "detach": True,
-        "remove": False,
         "volumes": volumes or None,
         "ports": {f"{SIDECAR_PORT}/tcp": None},  # random host port
         "name": f"mock-pod-{pod_id[:8]}",
+        "labels": {"mock-pod": "true", "pod-id": pod_id},
     }
-    if device_requests:
-        run_kwargs["device_requests"] = device_requests
+    if _detect_gpu():
+        kwargs["device_requests"] = [docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])]
+    return kwargs
 
-    container = docker_client.containers.run(**run_kwargs)
-    print(f"[mock-api] Container {container.short_id} started for pod {pod_id}")
 
-    # Resolve the randomly assigned host port for the sidecar
+def _started_updates(pod_id: str, container) -> dict:
+    """Resolve the sidecar host port and shape the post-start pod updates."""
     container.reload()
     host_port = container.ports.get(f"{SIDECAR_PORT}/tcp")
     sidecar_url = None
+    port_num = None
     if host_port:
         port_num = host_port[0]["HostPort"]
         sidecar_url = f"http://host.docker.internal:{port_num}"
         print(f"[mock-api] Sidecar reachable at {sidecar_url}")
 
     return {
-        "containerId": container.id,
-        "sidecarUrl": sidecar_url,
+        "_containerId": container.id,
+        "_containerObj": container,
+        "_sidecarUrl": sidecar_url,
         "portMappings": {str(SIDECAR_PORT): int(port_num) if host_port else None},
         "lastStartedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "lastStatusChange": f"Started by mock API at {time.strftime('%c')}",
         "desiredStatus": "RUNNING",
+        "_statusCachedAt": time.monotonic(),
     }
 
+
+def _pod_container(pod: dict):
+    """
+    Return the pod's Container handle. The handle cached at boot time is
+    preferred; docker_client.containers.get is only a fallback for records
+    that lost it (it costs a full daemon round trip just to build the object).
+    """
+    container = pod.get("_containerObj")
+    if container is None:
+        container = docker_client.containers.get(pod["_containerId"])
+        pod["_containerObj"] = container
+    return container
+
+
+def _start_container(pod_id: str, image: str, env: dict, name: str) -> dict:
+    """
+    Spin up a Docker container for this pod.
+    Returns updated fields to merge into the pod record.
+    """
+    container = docker_client.containers.run(**_container_kwargs(pod_id, image, env), remove=False)
+    print(f"[mock-api] Container {container.short_id} started for pod {pod_id}")
+    return _started_updates(pod_id, container)
+
+
+def _start_warm_container(pod_id: str, container_id: str) -> dict:
+    """Start a pre-created pool container instead of cold-creating one."""
+    container = docker_client.containers.get(container_id)
+    container.start()
+    print(f"[mock-api] Warm container {container.short_id} started for pod {pod_id}")
+    return _started_updates(pod_id, container)
+
+
+def _refill_pool():
+    """Top the warm pool back up to MOCK_POOL_SIZE. Best-effort."""
+    while _pool.qsize() < MOCK_POOL_SIZE:
+        pod_id = _new_pod_id()
+        try:
+            container = docker_client.containers.create(**_container_kwargs(pod_id, MOCK_IMAGE, {}))
+        except Exception as e:
+            print(f"[mock-api] Warning: could not pre-create warm container: {e}")
+            return
+        _pool.put((pod_id, container.id))
+        print(f"[mock-api] Warm container {container.short_id} ready (pool={_pool.qsize()})")
+
+
+def _drain_pool():
+    """Remove unconsumed warm containers so restarts don't leak them."""
+    while True:
+        try:
+            _, container_id = _pool.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            docker_client.containers.get(container_id).remove(force=True)
+            print(f"[mock-api] Removed warm container {container_id[:12]}")
+        except Exception as e:
+            print(f"[mock-api] Warning: could not remove warm container {container_id[:12]}: {e}")
+
+
+def _reap_stale_warm_containers():
+    """Remove created-but-never-started mock-pod containers left by earlier runs."""
+    try:
+        stale = docker_client.containers.list(
+            all=True, sparse=True,
+            filters={"label": "mock-pod=true", "status": "created"},
+        )
+    except Exception as e:
+        print(f"[mock-api] Warning: could not list stale warm containers: {e}")
+        return
+    for container in stale:
+        try:
+            container.remove(force=True)
+            print(f"[mock-api] Reaped stale warm container {container.id[:12]}")
+        except Exception as e:
+            print(f"[mock-api] Warning: could not reap container {container.id[:12]}: {e}")
+
+
+def _init_pool():
+    """Startup pool maintenance: reap leftovers from earlier runs, then fill."""
+    _reap_stale_warm_containers()
+    _refill_pool()
+
+
+def _new_pod_id() -> str:
+    return str(uuid.uuid4())[:14].replace("-", "")
+
 # ---------------------------------------------------------------------------
 # Request models
 # ---------------------------------------------------------------------------
@@ -161,6 +282,24 @@ class CreatePodRequest(BaseModel):
 # Endpoints
 # ---------------------------------------------------------------------------
 
+@app.on_event("startup")
+async def _warm_pool():
+    if MOCK_POOL_SIZE > 0:
+        if MOCK_API_WORKERS > 1:
+            # Each worker would reap the others' created-state warm
+            # containers at startup and then pop already-removed entries,
+            # so the pool is single-worker only.
+            print("[mock-api] Warm pool disabled with MOCK_API_WORKERS > 1")
+            return
+        _BOOT_POOL.submit(_init_pool)
+
+
+@app.on_event("shutdown")
+async def _shutdown_boot_pool():
+    _BOOT_POOL.shutdown(wait=False, cancel_futures=True)
+    _drain_pool()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "pods": len(_pods)}
@@ -170,11 +309,21 @@ async def health():
 async def create_pod(body: CreatePodRequest, authorization: Optional[str] = Header(None)):
     _check_auth(authorization)
 
-    pod_id = str(uuid.uuid4())[:14].replace("-", "")
     image = body.image or MOCK_IMAGE
-    name = body.name or f"mock-pod-{pod_id[:8]}"
     env = body.env or {}
 
+    # A warm container has its pod id and env baked in at create time, so it
+    # is only usable when the request doesn't customize either.
+    warm = None
+    if image == MOCK_IMAGE and not env:
+        try:
+            warm = _pool.get_nowait()
+        except queue.Empty:
+            pass
+
+    pod_id = warm[0] if warm else _new_pod_id()
+    name = body.name or f"mock-pod-{pod_id[:8]}"
+
     pod = {
         "id": pod_id,
         "name": name,
@@ -182,30 +331,47 @@ async def create_pod(body: CreatePodRequest, authorization: Optional[str] = Head
         "env": env,
         "ports": body.ports or [f"{SIDECAR_PORT}/http"],
         "containerDiskInGb": body.containerDiskInGb,
+        "volumeMountPath": "/workspace",
         "desiredStatus": "STARTING",
         "lastStartedAt": None,
         "lastStatusChange": f"Created by mock API at {time.strftime('%c')}",
-        "containerId": None,
-        "sidecarUrl": None,
+        "machine": _MACHINE_STUB,
+        "gpu": _GPU_STUB,
+        "costPerHr": "0.00",
+        "adjustedCostPerHr": 0.0,
+        "_containerId": None,
+        "_sidecarUrl": None,
         "portMappings": {},
+        # Seed every key background threads later write: readers iterate pod
+        # records lock-free, and value replacement is safe under the GIL
+        # where key insertion is not.
+        "_containerObj": None,
+        "_statusCachedAt": 0.0,
     }
 
+    global _pods
     with _lock:
-        _pods[pod_id] = pod
+        new_pods = dict(_pods)
+        new_pods[pod_id] = pod
+        _pods = new_pods
 
     # Start container in background so we return quickly (like the real API)
     def _boot():
         try:
-            updates = _start_container(pod_id, image, env, name)
-            with _lock:
-                _pods[pod_id].update(updates)
+            if warm:
+                updates = _start_warm_container(pod_id, warm[1])
+            else:
+                updates = _start_container(pod_id, image, env, name)
+            pod.update(updates)
         except Exception as e:
             print(f"[mock-api] Failed to start container for pod {pod_id}: {e}")
-            with _lock:
-                _pods[pod_id]["desiredStatus"] = "EXITED"
-                _pods[pod_id]["lastStatusChange"] = f"Boot failed: {e}"
+            pod["desiredStatus"] = "EXITED"
+            pod["lastStatusChange"] = f"Boot failed: {e}"
+            pod["_statusCachedAt"] = 0.0
 
-    threading.Thread(target=_boot, daemon=True).start()
+    asyncio.get_running_loop().run_in_executor(_BOOT_POOL, _boot)
+    if warm:
+        _BOOT_POOL.submit(_refill_pool)
 
     return _make_pod_response(pod)
 
@@ -213,27 +379,57 @@ async def create_pod(body: CreatePodRequest, authorization: Optional[str] = Head
 @app.get("/pods")
 async def list_pods(authorization: Optional[str] = Header(None)):
     _check_auth(authorization)
-    with _lock:
-        return [_make_pod_response(p) for p in _pods.values()]
+
+    # One server-side-filtered Docker call enriches every pod's status.
+    # sparse=True keeps it to a single round trip: without it docker-py
+    # inspects every listed container individually (and can raise NotFound
+    # for one removed mid-iteration). Sparse objects only carry the list
+    # shape, so labels/state are read from attrs.
+    state_by_pod_id = None
+    try:
+        state_by_pod_id = {}
+        for c in docker_client.containers.list(all=True, sparse=True, filters={"label": "mock-pod=true"}):
+            pod_id = (c.attrs.get("Labels") or {}).get("pod-id")
+            if pod_id:
+                state_by_pod_id[pod_id] = c.attrs.get("State", "")
+    except Exception as e:
+        print(f"[mock-api] Warning: could not list containers: {e}")
+        state_by_pod_id = None
+
+    pods = list(_pods.values())
+
+    if state_by_pod_id is not None:
+        now = time.monotonic()
+        for pod in pods:
+            if not pod.get("_containerId"):
+                continue
+            state = state_by_pod_id.get(pod["id"])
+            if state:
+                pod["desiredStatus"] = _STATUS_MAP.get(state, state.upper())
+            else:
+                pod["desiredStatus"] = "EXITED"
+            pod["_statusCachedAt"] = now
+
+    return [_make_pod_response(p) for p in pods]
 
 
 @app.get("/pods/{pod_id}")
 async def get_pod(pod_id: str, authorization: Optional[str] = Header(None)):
     _check_auth(authorization)
-    with _lock:
-        pod = _pods.get(pod_id)
+    pod = _pods.get(pod_id)
     if not pod:
         raise HTTPException(status_code=404, detail=f"Pod {pod_id} not found")
 
-    # Sync desiredStatus from actual container state
-    if pod.get("containerId"):
+    # Sync desiredStatus from actual container state (cached briefly so a
+    # polling client doesn't hammer the Docker daemon)
+    if pod.get("_containerId") and time.monotonic() - pod.get("_statusCachedAt", 0.0) >= STATUS_CACHE_TTL_S:
         try:
-            container = docker_client.containers.get(pod["containerId"])
+            container = _pod_container(pod)
             container.reload()
-            status_map = {"running": "RUNNING", "exited": "EXITED", "paused": "PAUSED", "created": "STARTING"}
-            pod["desiredStatus"] = status_map.get(container.status, container.status.upper())
+            pod["desiredStatus"] = _STATUS_MAP.get(container.status, container.status.upper())
         except docker.errors.NotFound:
             pod["desiredStatus"] = "EXITED"
+        pod["_statusCachedAt"] = time.monotonic()
 
     return _make_pod_response(pod)
 
@@ -241,14 +437,13 @@ async def get_pod(pod_id: str, authorization: Optional[str] = Header(None)):
 @app.post("/pods/{pod_id}/stop")
 async def stop_pod(pod_id: str, authorization: Optional[str] = Header(None)):
     _check_auth(authorization)
-    with _lock:
-        pod = _pods.get(pod_id)
+    pod = _pods.get(pod_id)
     if not pod:
         raise HTTPException(status_code=404, detail=f"Pod {pod_id} not found")
 
-    if pod.get("containerId"):
+    if pod.get("_containerId"):
         try:
-            container = docker_client.containers.get(pod["containerId"])
+            container = _pod_container(pod)
             container.stop(timeout=10)
             print(f"[mock-api] Stopped container for pod {pod_id}")
         except docker.errors.NotFound:
@@ -256,24 +451,27 @@ async def stop_pod(pod_id: str, authorization: Optional[str] = Header(None)):
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to stop container: {e}")
 
-    with _lock:
-        _pods[pod_id]["desiredStatus"] = "EXITED"
-        _pods[pod_id]["lastStatusChange"] = f"Stopped at {time.strftime('%c')}"
+    pod["desiredStatus"] = "EXITED"
+    pod["lastStatusChange"] = f"Stopped at {time.strftime('%c')}"
+    pod["_statusCachedAt"] = 0.0
 
-    return _make_pod_response(_pods[pod_id])
+    return _make_pod_response(pod)
 
 
 @app.delete("/pods/{pod_id}", status_code=204)
 async def terminate_pod(pod_id: str, authorization: Optional[str] = Header(None)):
     _check_auth(authorization)
+    global _pods
     with _lock:
-        pod = _pods.pop(pod_id, None)
+        new_pods = dict(_pods)
+        pod = new_pods.pop(pod_id, None)
+        _pods = new_pods
     if not pod:
         raise HTTPException(status_code=404, detail=f"Pod {pod_id} not found")
 
-    if pod.get("containerId"):
+    if pod.get("_containerId"):
         try:
-            container = docker_client.containers.get(pod["containerId"])
+            container = _pod_container(pod)
             container.remove(force=True)
             print(f"[mock-api] Removed container for pod {pod_id}")
         except docker.errors.NotFound:
@@ -289,7 +487,23 @@ async def terminate_pod(pod_id: str, authorization: Optional[str] = Header(None)
 # ---------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    print(f"[mock-api] RunPod Pod API mock starting on port {MOCK_API_PORT}")
+    workers = MOCK_API_WORKERS
+    print(f"[mock-api] RunPod Pod API mock starting on port {MOCK_API_PORT} ({workers} worker(s))")
     print(f"[mock-api] Image: {MOCK_IMAGE}")
     print(f"[mock-api] Auth key: {MOCK_API_KEY}")
-    uvicorn.run(app, host="0.0.0.0", port=MOCK_API_PORT, log_level="warning")
+    if workers > 1:
+        # The pod registry and warm pool are per-process; with multiple
+        # workers each one only sees the pods it created, so clients must
+        # stick to one connection (or keep workers=1). Forking requires the
+        # import-string form, which resolves when launched from the repo
+        # root (python -m orchestrators.pod_api_mock).
+        print("[mock-api] WARNING: pod registry is per-worker with MOCK_API_WORKERS > 1")
+        uvicorn.run(
+            "orchestrators.pod_api_mock:app",
+            host="0.0.0.0",
+            port=MOCK_API_PORT,
+            log_level="warning",
+            workers=workers,
+        )
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=MOCK_API_PORT, log_level="warning")
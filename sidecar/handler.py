@@ -7,23 +7,32 @@ Exposes a small FastAPI app that:
   - GET /health: simple liveness check
 """
 import asyncio
-import base64
 import json
 import os
+import queue
 import shutil
+import tempfile
+import threading
 import time
 import traceback
 import urllib.parse
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from io import BytesIO
 from typing import Any, Dict, List, Optional
 
+import anyio.to_thread
+import httpx
+import orjson
+import pybase64
 import requests
 import uvicorn
 import websocket
 from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
 
 # ---------------------------------------------------------------------------
 # Config
@@ -40,43 +49,105 @@ COMFY_READY_INTERVAL_S = float(os.environ.get("COMFY_READY_INTERVAL_S", "1.0"))
 WEBSOCKET_RECONNECT_ATTEMPTS = int(os.environ.get("WEBSOCKET_RECONNECT_ATTEMPTS", "5"))
 WEBSOCKET_RECONNECT_DELAY_S = int(os.environ.get("WEBSOCKET_RECONNECT_DELAY_S", "3"))
 
+# Hard wall-clock limit on a single job's execution monitoring
+JOB_TIMEOUT_S = int(os.environ.get("JOB_TIMEOUT_S", "3600"))
+
+# ---------------------------------------------------------------------------
+# HTTP sessions (persistent, connection-pooled)
+# ---------------------------------------------------------------------------
+
+# All ComfyUI traffic and external file transfers share one session so
+# repeated calls reuse sockets instead of paying a handshake per request.
+_COMFY = requests.Session()
+_COMFY.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# Callback deliveries go through a bounded async queue consumed by a few
+# httpx workers (started in lifespan), so a flapping callback URL ties up
+# queue slots instead of executor threads.
+CALLBACK_WORKERS = int(os.environ.get("CALLBACK_WORKERS", "4"))
+CALLBACK_QUEUE_MAX = int(os.environ.get("CALLBACK_QUEUE_MAX", "1024"))
+
+_cb_queue: Optional["asyncio.Queue"] = None
+_cb_client: Optional[httpx.AsyncClient] = None
+
 # ---------------------------------------------------------------------------
 # Startup: poll ComfyUI, fire ready callback
 # ---------------------------------------------------------------------------
 
 def _wait_for_comfy() -> bool:
-    url = f"http://{COMFY_HOST}/"
+    # /system_stats only answers once ComfyUI is actually serving, unlike /
+    # which can 200 before startup finishes. Poll fast at first (ComfyUI is
+    # usually up within seconds) and back off to 2 s for the long tail.
+    url = f"http://{COMFY_HOST}/system_stats"
     print(f"[sidecar] Waiting for ComfyUI at {url}...")
-    for attempt in range(COMFY_READY_MAX_RETRIES):
+    deadline = time.monotonic() + COMFY_READY_MAX_RETRIES * COMFY_READY_INTERVAL_S
+    delay = 0.05
+    while time.monotonic() < deadline:
         try:
-            r = requests.get(url, timeout=5)
+            r = _COMFY.get(url, timeout=2)
             if r.status_code == 200:
-                print(f"[sidecar] ComfyUI ready after {attempt + 1} attempts")
+                print("[sidecar] ComfyUI ready")
                 return True
         except Exception:
             pass
-        time.sleep(COMFY_READY_INTERVAL_S)
-    print(f"[sidecar] ComfyUI did not become ready after {COMFY_READY_MAX_RETRIES} attempts")
+        time.sleep(delay)
+        delay = min(delay * 1.5, 2.0)
+    print(f"[sidecar] ComfyUI did not become ready within {COMFY_READY_MAX_RETRIES * COMFY_READY_INTERVAL_S:.0f}s")
     return False
 
 
 def _fire_callback(url: str, payload: dict, label: str = "callback"):
-    """POST payload to url with basic retry. Best-effort, never raises."""
-    for attempt in range(3):
+    """Enqueue a callback for async delivery. Best-effort, never raises."""
+    try:
+        _cb_queue.put_nowait((url, payload, label))
+    except asyncio.QueueFull:
+        print(f"[sidecar] callback queue full, dropping {label}")
+
+
+async def _cb_worker(q: "asyncio.Queue", client: httpx.AsyncClient):
+    """Deliver queued callbacks with retry + backoff."""
+    while True:
+        url, payload, label = await q.get()
         try:
-            r = requests.post(url, json=payload, timeout=30)
-            if r.status_code < 300:
-                print(f"[sidecar] {label} delivered (attempt {attempt + 1})")
-                return
-            print(f"[sidecar] {label} got {r.status_code}, retrying...")
-        except Exception as e:
-            print(f"[sidecar] {label} attempt {attempt + 1} failed: {e}")
-        time.sleep(5)
-    print(f"[sidecar] {label} failed after 3 attempts")
+            delay = 1.0
+            for attempt in range(3):
+                try:
+                    r = await client.post(
+                        url,
+                        content=orjson.dumps(payload),
+                        headers={"Content-Type": "application/json"},
+                    )
+                    if r.status_code < 300:
+                        print(f"[sidecar] {label} delivered (attempt {attempt + 1})")
+                        break
+                    print(f"[sidecar] {label} got {r.status_code}, retrying...")
+                except Exception as e:
+                    print(f"[sidecar] {label} attempt {attempt + 1} failed: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+            else:
+                print(f"[sidecar] {label} failed after 3 attempts")
+        finally:
+            q.task_done()
+
+
+SIDECAR_THREADPOOL_SIZE = int(os.environ.get("SIDECAR_THREADPOOL_SIZE", "200"))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Widen the default 40-token anyio threadpool that Starlette uses to
+    # dispatch sync endpoints, so slow /health probes can't starve it.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SIDECAR_THREADPOOL_SIZE
+
+    global _cb_queue, _cb_client
+    _cb_queue = asyncio.Queue(maxsize=CALLBACK_QUEUE_MAX)
+    _cb_client = httpx.AsyncClient(timeout=30)
+    cb_workers = [
+        asyncio.create_task(_cb_worker(_cb_queue, _cb_client))
+        for _ in range(CALLBACK_WORKERS)
+    ]
+
     loop = asyncio.get_event_loop()
     ready_callback_url = os.environ.get("READY_CALLBACK_URL", "")
 
@@ -84,15 +155,19 @@ async def lifespan(app: FastAPI):
         ok = await loop.run_in_executor(None, _wait_for_comfy)
         if ready_callback_url:
             payload = {"event": "ready", "pod_id": POD_ID, "success": ok}
-            await loop.run_in_executor(None, _fire_callback, ready_callback_url, payload, "ready-callback")
+            _fire_callback(ready_callback_url, payload, "ready-callback")
         else:
             print("[sidecar] No READY_CALLBACK_URL set, skipping ready callback")
 
     asyncio.create_task(_startup())
     yield
 
+    for task in cb_workers:
+        task.cancel()
+    await _cb_client.aclose()
 
-app = FastAPI(title="Lovegood Pod Sidecar", lifespan=lifespan)
+
+app = FastAPI(title="Lovegood Pod Sidecar", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # ---------------------------------------------------------------------------
 # Auth
@@ -121,10 +196,12 @@ class RunRequest(BaseModel):
 # ---------------------------------------------------------------------------
 
 @app.get("/health")
-async def health():
+def health():
+    # Plain def: the requests call below is blocking, so let Starlette run
+    # this in its threadpool instead of on the event loop.
     comfy_ok = False
     try:
-        r = requests.get(f"http://{COMFY_HOST}/", timeout=3)
+        r = _COMFY.get(f"http://{COMFY_HOST}/", timeout=3)
         comfy_ok = r.status_code == 200
     except Exception:
         pass
@@ -166,21 +243,19 @@ def _execute_job(job_id: str, req: RunRequest) -> dict:
             if r["status"] == "error":
                 return {"status": "failed", "error": "File download/upload failed", "details": r["details"]}
 
-        client_id = str(uuid.uuid4())
-        ws_url = f"ws://{COMFY_HOST}/ws?clientId={client_id}"
-        ws = websocket.WebSocket()
-        ws.connect(ws_url, timeout=10)
+        # All jobs share one WebSocket (and client id) to ComfyUI; the reader
+        # thread routes each prompt's messages to its registered listener.
+        # The socket must be live before queueing or ComfyUI drops the events.
+        if not _ensure_ws_reader():
+            return {"status": "failed", "error": "Could not establish ComfyUI WebSocket"}
 
-        try:
-            queued = _queue_workflow(req.workflow, client_id, req.comfy_org_api_key)
-            prompt_id = queued.get("prompt_id")
-            if not prompt_id:
-                return {"status": "failed", "error": f"No prompt_id in response: {queued}"}
-            print(f"[sidecar] Job {job_id} -> prompt {prompt_id}")
-            execution_done, exec_errors = _monitor_execution(ws, ws_url, prompt_id)
-        finally:
-            if ws.connected:
-                ws.close()
+        queued = _queue_workflow(req.workflow, _CLIENT_ID, req.comfy_org_api_key)
+        prompt_id = queued.get("prompt_id")
+        if not prompt_id:
+            return {"status": "failed", "error": f"No prompt_id in response: {queued}"}
+        print(f"[sidecar] Job {job_id} -> prompt {prompt_id}")
+        listener = _register_ws_listener(prompt_id)
+        execution_done, exec_errors = _monitor_execution(prompt_id, listener)
 
         if not execution_done and not exec_errors:
             return {"status": "failed", "error": "Execution monitoring exited unexpectedly"}
@@ -209,10 +284,126 @@ def _execute_job(job_id: str, req: RunRequest) -> dict:
 # ComfyUI helpers
 # ---------------------------------------------------------------------------
 
+# Lowercased file extensions treated as video (everything else is an image)
+_VIDEO_EXTS = frozenset({"mp4", "mov", "avi", "mkv", "webm"})
+
+
+def _is_video(filename: str) -> bool:
+    return filename.rpartition(".")[2].lower() in _VIDEO_EXTS
+
+# Long-lived WebSocket to ComfyUI, shared across jobs so each run doesn't
+# pay a fresh TCP+WS handshake. Exactly one reader thread owns recv() (the
+# websocket-client frame state is not thread-safe) and routes each prompt's
+# terminal messages to the queue its monitor registered in _ws_listeners.
+_CLIENT_ID = str(uuid.uuid4())
+_WS_URL = f"ws://{COMFY_HOST}/ws?clientId={_CLIENT_ID}"
+_ws_lock = threading.Lock()
+_ws_reader_thread: Optional[threading.Thread] = None
+_ws_connected = threading.Event()
+_ws_listeners: Dict[str, "queue.Queue"] = {}
+# Terminal messages that arrived before their monitor registered (the prompt
+# id is only known after /prompt returns, so there is a small window)
+_ws_pending: Dict[str, dict] = {}
+_WS_PENDING_MAX = 64
+
+
+def _register_ws_listener(prompt_id: str) -> "queue.Queue":
+    q: "queue.Queue" = queue.Queue()
+    with _ws_lock:
+        pending = _ws_pending.pop(prompt_id, None)
+        _ws_listeners[prompt_id] = q
+    if pending is not None:
+        q.put(pending)
+    return q
+
+
+def _unregister_ws_listener(prompt_id: str):
+    with _ws_lock:
+        _ws_listeners.pop(prompt_id, None)
+        _ws_pending.pop(prompt_id, None)
+
+
+def _ws_broadcast(msg: dict):
+    with _ws_lock:
+        queues = list(_ws_listeners.values())
+    for q in queues:
+        q.put(msg)
+
+
+def _ws_dispatch(msg: dict):
+    prompt_id = msg.get("data", {}).get("prompt_id")
+    if not prompt_id:
+        return
+    with _ws_lock:
+        q = _ws_listeners.get(prompt_id)
+        if q is None:
+            # Park it for a monitor that hasn't registered yet
+            while len(_ws_pending) >= _WS_PENDING_MAX:
+                _ws_pending.pop(next(iter(_ws_pending)))
+            _ws_pending[prompt_id] = msg
+    if q is not None:
+        q.put(msg)
+
+
+def _ws_reader():
+    """Sole owner of the shared WebSocket: connect, read, parse, dispatch."""
+    ws = None
+    failures = 0
+    while True:
+        if ws is None or not ws.connected:
+            _ws_connected.clear()
+            try:
+                _COMFY.get(f"http://{COMFY_HOST}/", timeout=5).raise_for_status()
+                ws = websocket.WebSocket()
+                ws.connect(_WS_URL, timeout=10)
+                ws.settimeout(30)
+                _ws_connected.set()
+                failures = 0
+                print("[sidecar] WebSocket connected")
+            except Exception as e:
+                ws = None
+                failures += 1
+                if failures == WEBSOCKET_RECONNECT_ATTEMPTS:
+                    # Fail waiting monitors instead of letting them sit out
+                    # their whole job deadline
+                    _ws_broadcast({"type": "_sidecar_error", "error": f"WebSocket unavailable: {e}"})
+                time.sleep(WEBSOCKET_RECONNECT_DELAY_S)
+                continue
+        try:
+            out = ws.recv()
+        except websocket.WebSocketTimeoutException:
+            continue
+        except Exception as e:
+            print(f"[sidecar] WebSocket dropped: {e}")
+            ws = None
+            continue
+        # Cheap prefilter: skip binary frames (preview images) and anything
+        # that can't be a JSON object before paying for a parse
+        if not isinstance(out, str) or not out.startswith("{"):
+            continue
+        try:
+            msg = orjson.loads(out)
+        except orjson.JSONDecodeError:
+            continue
+        # Chatty per-step messages (progress etc.) don't matter here
+        if msg.get("type") in ("executing", "execution_error"):
+            _ws_dispatch(msg)
+
+
+def _ensure_ws_reader(timeout: float = 15.0) -> bool:
+    """Start the reader thread if needed; wait for a live connection."""
+    global _ws_reader_thread
+    with _ws_lock:
+        if _ws_reader_thread is None or not _ws_reader_thread.is_alive():
+            _ws_reader_thread = threading.Thread(target=_ws_reader, daemon=True, name="comfy-ws")
+            _ws_reader_thread.start()
+    return _ws_connected.wait(timeout)
+
+
 def _check_server(url: str, retries: int = 5, delay: float = 1.0) -> bool:
     for _ in range(retries):
         try:
-            if requests.get(url, timeout=5).status_code == 200:
+            if _COMFY.get(url, timeout=5).status_code == 200:
                 return True
         except Exception:
             pass
@@ -220,62 +411,113 @@ def _check_server(url: str, retries: int = 5, delay: float = 1.0) -> bool:
     return False
 
 
+# Paths renamed aside by _cleanup_comfyui_directories, deleted off the job path
+_gc_queue: "queue.Queue" = queue.Queue()
+
+
+def _gc_worker():
+    while True:
+        path = _gc_queue.get()
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # re-enqueued by a later cleanup pass and already deleted
+        except Exception as e:
+            print(f"[sidecar] GC warning: {path}: {e}")
+        finally:
+            _gc_queue.task_done()
+
+
+threading.Thread(target=_gc_worker, daemon=True, name="comfy-gc").start()
+
+
 def _cleanup_comfyui_directories():
+    """
+    Move stale job files aside with an O(1) rename so execution can start
+    immediately; the GC thread does the actual (possibly slow) deletion.
+    """
     preserve = {"/comfyui/input/demo"}
     for directory in ["/comfyui/input", "/comfyui/output", "/comfyui/temp"]:
         if not os.path.exists(directory):
             continue
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            if item_path in preserve:
-                continue
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.path in preserve:
+                    continue
+                if ".gc-" in entry.name:
+                    # Already renamed for deletion; the queue is in-memory,
+                    # so entries orphaned by a restart must be re-enqueued
+                    # or they would leak disk forever
+                    _gc_queue.put(entry.path)
+                    continue
+                entries.append(entry.path)
+        for item_path in entries:
+            trash_path = f"{item_path}.gc-{uuid.uuid4().hex}"
             try:
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
+                os.rename(item_path, trash_path)
             except Exception as e:
                 print(f"[sidecar] Cleanup warning: {item_path}: {e}")
+                continue
+            _gc_queue.put(trash_path)
+
+
+def _upload_one(image: dict) -> Optional[str]:
+    """Upload a single base64 input image to ComfyUI. Returns an error string or None."""
+    try:
+        name = image["name"]
+        data = image["image"]
+        if "," in data:
+            data = data.split(",", 1)[1]
+        # pybase64 decodes with SIMD; passing the bytes straight to requests
+        # skips the BytesIO wrapper's extra copy of the blob
+        blob = pybase64.b64decode(data, validate=False)
+        files = {"image": (name, blob, "image/png"), "overwrite": (None, "true")}
+        _COMFY.post(f"http://{COMFY_HOST}/upload/image", files=files, timeout=30).raise_for_status()
+        return None
+    except Exception as e:
+        return f"Failed to upload {image.get('name')}: {e}"
 
 
 def _upload_images(images: list) -> dict:
-    errors = []
-    for image in images:
-        try:
-            name = image["name"]
-            data = image["image"]
-            if "," in data:
-                data = data.split(",", 1)[1]
-            blob = base64.b64decode(data)
-            files = {"image": (name, BytesIO(blob), "image/png"), "overwrite": (None, "true")}
-            requests.post(f"http://{COMFY_HOST}/upload/image", files=files, timeout=30).raise_for_status()
-        except Exception as e:
-            errors.append(f"Failed to upload {image.get('name')}: {e}")
+    if not images:
+        return {"status": "success", "details": []}
+    with ThreadPoolExecutor(max_workers=min(8, len(images))) as ex:
+        errors = [err for err in ex.map(_upload_one, images) if err]
     return {"status": "error" if errors else "success", "details": errors}
 
 
-def _download_and_upload_files(download_urls: list) -> dict:
-    errors = []
-    for item in download_urls:
-        try:
-            name = item["name"]
-            file_bytes = requests.get(item["url"], timeout=120).content
-            subfolder, filename = (name.rsplit("/", 1) if "/" in name else ("", name))
-            name_lower = filename.lower()
-
-            if name_lower.endswith(('.mp4', '.mov', '.avi', '.mkv', '.webm')):
-                endpoint = f"http://{COMFY_HOST}/upload/video"
-                content_type, form_field = "video/mp4", "video"
-            else:
-                endpoint = f"http://{COMFY_HOST}/upload/image"
-                content_type, form_field = "image/png", "image"
+def _download_one(item: dict) -> Optional[str]:
+    """Fetch one external file and push it into ComfyUI. Returns an error string or None."""
+    try:
+        name = item["name"]
+        file_bytes = _COMFY.get(item["url"], timeout=120).content
+        subfolder, filename = (name.rsplit("/", 1) if "/" in name else ("", name))
 
-            files = {form_field: (filename, BytesIO(file_bytes), content_type), "overwrite": (None, "true")}
-            if subfolder:
-                files["subfolder"] = (None, subfolder)
-            requests.post(endpoint, files=files, timeout=60).raise_for_status()
-        except Exception as e:
-            errors.append(f"Failed to process {item.get('name')}: {e}")
+        if _is_video(filename):
+            endpoint = f"http://{COMFY_HOST}/upload/video"
+            content_type, form_field = "video/mp4", "video"
+        else:
+            endpoint = f"http://{COMFY_HOST}/upload/image"
+            content_type, form_field = "image/png", "image"
+
+        files = {form_field: (filename, BytesIO(file_bytes), content_type), "overwrite": (None, "true")}
+        if subfolder:
+            files["subfolder"] = (None, subfolder)
+        _COMFY.post(endpoint, files=files, timeout=60).raise_for_status()
+        return None
+    except Exception as e:
+        return f"Failed to process {item.get('name')}: {e}"
+
+
+def _download_and_upload_files(download_urls: list) -> dict:
+    if not download_urls:
+        return {"status": "success", "details": []}
+    with ThreadPoolExecutor(max_workers=min(8, len(download_urls))) as ex:
+        errors = [err for err in ex.map(_download_one, download_urls) if err]
     return {"status": "error" if errors else "success", "details": errors}
 
 
@@ -284,7 +526,7 @@ def _queue_workflow(workflow: dict, client_id: str, comfy_org_api_key: Optional[
     effective_key = comfy_org_api_key or os.environ.get("COMFY_ORG_API_KEY")
     if effective_key:
         payload["extra_data"] = {"api_key_comfy_org": effective_key}
-    r = requests.post(
+    r = _COMFY.post(
         f"http://{COMFY_HOST}/prompt",
         data=json.dumps(payload).encode(),
         headers={"Content-Type": "application/json"},
@@ -296,58 +538,55 @@ def _queue_workflow(workflow: dict, client_id: str, comfy_org_api_key: Optional[
     return r.json()
 
 
-def _monitor_execution(ws: websocket.WebSocket, ws_url: str, prompt_id: str):
+def _monitor_execution(prompt_id: str, listener: "queue.Queue"):
+    """Wait on the prompt's message queue until it finishes, errors, or times out."""
     errors = []
-    while True:
-        try:
-            out = ws.recv()
-            if not isinstance(out, str):
+    deadline = time.monotonic() + JOB_TIMEOUT_S
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                errors.append(f"Job deadline exceeded after {JOB_TIMEOUT_S}s")
+                return False, errors
+            try:
+                msg = listener.get(timeout=min(remaining, 30))
+            except queue.Empty:
                 continue
-            msg = json.loads(out)
+
             msg_type = msg.get("type")
+            if msg_type == "_sidecar_error":
+                errors.append(msg["error"])
+                return False, errors
 
+            data = msg.get("data", {})
             if msg_type == "executing":
-                data = msg.get("data", {})
-                if data.get("node") is None and data.get("prompt_id") == prompt_id:
+                if data.get("node") is None:
                     return True, errors
+            else:
+                errors.append(
+                    f"Node {data.get('node_id')} ({data.get('node_type')}): {data.get('exception_message')}"
+                )
+                return False, errors
+    finally:
+        _unregister_ws_listener(prompt_id)
 
-            elif msg_type == "execution_error":
-                data = msg.get("data", {})
-                if data.get("prompt_id") == prompt_id:
-                    errors.append(
-                        f"Node {data.get('node_id')} ({data.get('node_type')}): {data.get('exception_message')}"
-                    )
-                    return False, errors
 
-        except websocket.WebSocketTimeoutException:
-            continue
-        except websocket.WebSocketConnectionClosedException as e:
-            ws = _reconnect_websocket(ws_url, e)
-        except json.JSONDecodeError:
-            continue
+class _SizedReader:
+    """
+    File-like wrapper exposing a known length so requests sends a
+    Content-Length body instead of falling back to chunked encoding.
+    """
 
+    def __init__(self, raw, length: int):
+        self._raw = raw
+        self.len = length
 
-def _reconnect_websocket(ws_url: str, initial_error: Exception) -> websocket.WebSocket:
-    for attempt in range(WEBSOCKET_RECONNECT_ATTEMPTS):
-        try:
-            requests.get(f"http://{COMFY_HOST}/", timeout=5).raise_for_status()
-        except Exception:
-            raise websocket.WebSocketConnectionClosedException("ComfyUI unreachable during reconnect")
-        try:
-            new_ws = websocket.WebSocket()
-            new_ws.connect(ws_url, timeout=10)
-            print(f"[sidecar] WebSocket reconnected on attempt {attempt + 1}")
-            return new_ws
-        except Exception as e:
-            print(f"[sidecar] Reconnect attempt {attempt + 1} failed: {e}")
-            time.sleep(WEBSOCKET_RECONNECT_DELAY_S)
-    raise websocket.WebSocketConnectionClosedException(
-        f"Failed to reconnect after {WEBSOCKET_RECONNECT_ATTEMPTS} attempts"
-    )
+    def read(self, amt=-1):
+        return self._raw.read(amt)
 
 
 def _get_history(prompt_id: str) -> dict:
-    r = requests.get(f"http://{COMFY_HOST}/history/{prompt_id}", timeout=30)
+    r = _COMFY.get(f"http://{COMFY_HOST}/history/{prompt_id}", timeout=30)
     r.raise_for_status()
     return r.json()
 
@@ -367,25 +606,47 @@ def _process_outputs(outputs: dict, upload_urls: Optional[List[Dict[str, str]]])
                     continue
 
                 params = urllib.parse.urlencode({"filename": filename, "subfolder": subfolder, "type": file_type})
-                try:
-                    file_bytes = requests.get(f"http://{COMFY_HOST}/view?{params}", timeout=60).content
-                except Exception as e:
-                    errors.append(f"Failed to fetch {filename}: {e}")
-                    continue
+                view_url = f"http://{COMFY_HOST}/view?{params}"
 
                 upload_url = upload_map.get(filename)
                 if upload_url:
+                    # Stream straight from ComfyUI into the PUT so the file
+                    # never has to fit in memory (video outputs can be huge).
                     try:
-                        content_type = "video/mp4" if filename.endswith(('.mp4', '.mov', '.avi')) else "image/png"
-                        requests.put(upload_url, data=file_bytes, headers={"Content-Type": content_type}, timeout=60).raise_for_status()
+                        content_type = "video/mp4" if _is_video(filename) else "image/png"
+                        with _COMFY.get(view_url, stream=True, timeout=60) as r:
+                            r.raise_for_status()
+                            headers = {"Content-Type": content_type}
+                            length = r.headers.get("Content-Length")
+                            if length is not None:
+                                # A sized body makes requests emit a single
+                                # Content-Length header; a bare r.raw would
+                                # fall back to chunked transfer encoding,
+                                # which presigned upload URLs reject.
+                                body = _SizedReader(r.raw, int(length))
+                                _COMFY.put(upload_url, data=body, headers=headers, timeout=60).raise_for_status()
+                            else:
+                                # No length from ComfyUI: spool to learn the
+                                # size (small files stay in memory)
+                                with tempfile.SpooledTemporaryFile(max_size=8 << 20) as tmp:
+                                    shutil.copyfileobj(r.raw, tmp)
+                                    tmp.seek(0)
+                                    _COMFY.put(upload_url, data=tmp, headers=headers, timeout=60).raise_for_status()
                         output_data.append({"filename": filename, "type": "uploaded"})
                     except Exception as e:
                         errors.append(f"Failed to upload {filename}: {e}")
                 else:
+                    # base64 fallback has to hold the bytes to embed them in
+                    # the callback payload
+                    try:
+                        file_bytes = _COMFY.get(view_url, timeout=60).content
+                    except Exception as e:
+                        errors.append(f"Failed to fetch {filename}: {e}")
+                        continue
                     output_data.append({
                         "filename": filename,
                         "type": "base64",
-                        "data": base64.b64encode(file_bytes).decode()
+                        "data": pybase64.b64encode(file_bytes).decode("ascii")
                     })
 
     return output_data, errors